@@ -1,9 +1,28 @@
 import streamlit as st
+import bisect
+import difflib
+import hashlib
+import hmac
 import json
+import mmap
 import os
+import re
+import secrets
+import struct
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager, nullcontext
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeout
+from datetime import datetime
 from pathlib import Path
 from typing import Dict, List
 
+try:
+    import fcntl
+except ImportError:  # Windows: appends are only serialised within one process
+    fcntl = None
+
 # ===========================
 # --------- CONFIG ----------
 # ===========================
@@ -54,14 +73,17 @@ st.markdown(CUSTOM_CSS, unsafe_allow_html=True)
 # ===========================
 # --------- STORAGE ---------
 # ===========================
-DATA_DIR = Path(".")
-FILES = {
-    "users": DATA_DIR / "user_db.json",            # includes admin + attempts/blocked
-    "lecturers": DATA_DIR / "lecturers.json",
-    "exam_personnel": DATA_DIR / "exam_personnel.json",
-    "subjects": DATA_DIR / "subjects.json",
-    "questions": DATA_DIR / "questions.json",
-    "exam_papers": DATA_DIR / "exam_papers.json",
+DATA_DIR = Path(".")                     # data of the default tenant
+TENANTS_DIR = DATA_DIR / "tenants"       # one sub-directory per additional tenant
+DEFAULT_TENANT = "default"
+TENANT_CACHE_SIZE = int(os.environ.get("EMS_TENANT_CACHE_SIZE", "16"))
+FILE_NAMES = {
+    "users": "user_db.json",            # includes admin + attempts/blocked
+    "lecturers": "lecturers.json",
+    "exam_personnel": "exam_personnel.json",
+    "subjects": "subjects.json",
+    "questions": "questions.json",
+    "exam_papers": "exam_papers.json",
 }
 
 DEFAULTS = {
@@ -86,31 +108,557 @@ def save_json(path: Path, data):
     with open(path, "w", encoding="utf-8") as f:
         json.dump(data, f, indent=2, ensure_ascii=False)
 
-def ensure_files():
-    for key, path in FILES.items():
-        if not path.exists():
-            save_json(path, DEFAULTS[key])
+@contextmanager
+def file_lock(path: Path):
+    # Exclusive lock shared by every server process; a no-op where fcntl is missing.
+    with open(path, "a") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+# ===========================
+# ------ BANK SNAPSHOT ------
+# ===========================
+# Compiled, read-only copy of questions.json shared by every server process.
+# Layout: MAGIC | u64 directory length | u64 slot count | JSON directory
+#         | packed slots (u64 offset, u32 length) | question records (UTF-8 JSON).
+# The directory only maps subject -> topic -> [first slot, count]; per-question
+# offsets stay in the mapped slot table and are unpacked on demand, so a worker
+# holds no per-question data on its own heap.
+SNAPSHOT_NAME = "questions.snap"
+WRITE_LOCK_NAME = ".write.lock"
+SNAPSHOT_MAGIC = b"EMSBANK2"
+SNAPSHOT_HEADER = struct.Struct("<8sQQ")
+SNAPSHOT_SLOT = struct.Struct("<QI")
+
+def build_bank_snapshot(questions: Dict, path: Path):
+    records = bytearray()
+    slots = bytearray()
+    directory = {}
+    n_slots = 0
+    for subj, topics in questions.items():
+        for topic, q_list in topics.items():
+            directory.setdefault(subj, {})[topic] = [n_slots, len(q_list)]
+            for q in q_list:
+                blob = json.dumps(q, ensure_ascii=False).encode("utf-8")
+                slots += SNAPSHOT_SLOT.pack(len(records), len(blob))
+                records += blob
+                n_slots += 1
+    dir_blob = json.dumps(directory, ensure_ascii=False).encode("utf-8")
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    with open(tmp, "wb") as f:
+        f.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, len(dir_blob), n_slots))
+        f.write(dir_blob)
+        f.write(slots)
+        f.write(records)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)  # atomic: readers see the old or the new snapshot, never a mix
+
+class BankSnapshot:
+    """Memory-mapped view of the compiled question bank, swapped when a new one lands."""
+
+    def __init__(self, path: Path, questions_path: Path, lock_path: Path):
+        self.path = path
+        self.questions_path = questions_path
+        self.lock_path = lock_path
+        self._lock = threading.Lock()
+        # (key, mmap, slot base, record base, directory) replaced as one object, never
+        # mutated in place, so a reader always gets a mapping and a directory that belong together.
+        self._state = (None, None, 0, 0, {})
+
+    def ensure(self):
+        q_path = self.questions_path
+        with file_lock(self.lock_path):
+            if (not self.path.exists() or not self._current_format()
+                    or (q_path.exists() and q_path.stat().st_mtime_ns > self.path.stat().st_mtime_ns)):
+                build_bank_snapshot(load_json(q_path, DEFAULTS["questions"]), self.path)
+
+    def _current_format(self) -> bool:
+        with open(self.path, "rb") as f:
+            return f.read(len(SNAPSHOT_MAGIC)) == SNAPSHOT_MAGIC
+
+    def close(self):
+        # Old mapping is dropped, not closed: in-flight readers keep it alive.
+        self._state = (None, None, 0, 0, {})
+
+    def _current(self):
+        try:
+            st_ = os.stat(self.path)
+        except FileNotFoundError:
+            self.ensure()
+            st_ = os.stat(self.path)
+        key = (st_.st_ino, st_.st_mtime_ns, st_.st_size)
+        state = self._state
+        if key != state[0]:
+            with self._lock:
+                state = self._state
+                if key != state[0]:
+                    with open(self.path, "rb") as f:
+                        fst = os.fstat(f.fileno())
+                        key = (fst.st_ino, fst.st_mtime_ns, fst.st_size)
+                        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                    magic, dir_len, n_slots = SNAPSHOT_HEADER.unpack_from(mm, 0)
+                    if magic != SNAPSHOT_MAGIC:
+                        raise ValueError(f"{self.path} is not a question bank snapshot")
+                    slot_base = SNAPSHOT_HEADER.size + dir_len
+                    directory = json.loads(str(memoryview(mm)[SNAPSHOT_HEADER.size:slot_base], "utf-8"))
+                    state = (key, mm, slot_base, slot_base + n_slots * SNAPSHOT_SLOT.size, directory)
+                    self._state = state
+        return state[1:]
+
+    def subjects(self) -> List[str]:
+        return list(self._current()[3].keys())
+
+    def topics(self, subj: str) -> List[str]:
+        return list(self._current()[3].get(subj, {}).keys())
+
+    def count(self, subj: str, topic: str) -> int:
+        return self._current()[3].get(subj, {}).get(topic, [0, 0])[1]
+
+    def question(self, subj: str, topic: str, idx: int) -> Dict:
+        mm, slot_base, rec_base, directory = self._current()
+        start, count = directory[subj][topic]
+        if not 0 <= idx < count:
+            raise IndexError(f"question index {idx} out of range")
+        off, length = SNAPSHOT_SLOT.unpack_from(mm, slot_base + (start + idx) * SNAPSHOT_SLOT.size)
+        return json.loads(str(memoryview(mm)[rec_base + off:rec_base + off + length], "utf-8"))
+
+# ===========================
+# ---- REVISION HISTORY -----
+# ===========================
+# Every change to a topic's question list or an exam paper section is appended to
+# history.jsonl as one revision of that record. Most revisions are deltas against
+# the previous one (copy ranges of unchanged items + the new items); every
+# HISTORY_KEYFRAME_EVERY-th revision is a full keyframe, so rebuilding any version
+# reads at most that many lines. An in-memory index of (ts, offset, keyframe) per
+# record is built incrementally from the log and seeks straight to those lines.
+HISTORY_NAME = "history.jsonl"
+HISTORY_KINDS = ("questions", "exam_papers")
+HISTORY_KEYFRAME_EVERY = 16
+PREHISTORY_TS = 0.0   # timestamp of baseline revisions: content from before tracking began
+
+def _item_key(item) -> str:
+    return json.dumps(item, sort_keys=True, ensure_ascii=False)
+
+def make_delta(prev: List, items: List) -> List:
+    ops = []
+    matcher = difflib.SequenceMatcher(None, [_item_key(i) for i in prev], [_item_key(i) for i in items], autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            ops.append(["c", i1, i2])
+        elif tag in ("replace", "insert"):
+            ops.append(["a", items[j1:j2]])
+    return ops
+
+def apply_delta(prev: List, ops: List) -> List:
+    items = []
+    for op in ops:
+        if op[0] == "c":
+            items.extend(prev[op[1]:op[2]])
+        else:
+            items.extend(op[1])
+    return items
+
+class RevisionLog:
+    """Append-only, delta-encoded revision history of the records of one tenant."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._read_upto = 0
+        self._index = {}   # (kind, outer, inner) -> [(ts, offset, is_keyframe), ...]
+
+    def close(self):
+        with self._lock:
+            self._read_upto, self._index = 0, {}
+
+    def _refresh(self):
+        if not self.path.exists():
+            self._read_upto, self._index = 0, {}
+            return
+        if self.path.stat().st_size < self._read_upto:   # log was replaced; start over
+            self._read_upto, self._index = 0, {}
+        with open(self.path, "rb") as f:
+            f.seek(self._read_upto)
+            offset = self._read_upto
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break   # another process is mid-append
+                entry = json.loads(line)
+                self._index.setdefault(tuple(entry["rec"]), []).append((entry["ts"], offset, "kf" in entry))
+                offset += len(line)
+        self._read_upto = offset
 
-ensure_files()
+    def _materialize(self, revs: List, version: int) -> List:
+        start = version
+        while not revs[start][2]:
+            start -= 1
+        items = []
+        with open(self.path, "rb") as f:
+            for _, offset, is_kf in revs[start:version + 1]:
+                f.seek(offset)
+                entry = json.loads(f.readline())
+                items = entry["kf"] if is_kf else apply_delta(items, entry["d"])
+        return items
+
+    def records(self, kind: str) -> List:
+        with self._lock:
+            self._refresh()
+            return [rec[1:] for rec in self._index if rec[0] == kind]
+
+    def revisions(self, rec: tuple) -> List:
+        with self._lock:
+            self._refresh()
+            return [(v, ts) for v, (ts, _, _) in enumerate(self._index.get(rec, []))]
+
+    def at(self, rec: tuple, version: int) -> List:
+        with self._lock:
+            self._refresh()
+            return self._materialize(self._index[rec], version)
+
+    def version_as_of(self, rec: tuple, ts: float):
+        """Number of the revision of ``rec`` in effect at time ``ts``, or None."""
+        with self._lock:
+            self._refresh()
+            version = bisect.bisect_right([r[0] for r in self._index.get(rec, [])], ts) - 1
+            return version if version >= 0 else None
+
+    def as_of(self, rec: tuple, ts: float):
+        """Items of ``rec`` as they were at time ``ts``, or None if nothing was recorded by then."""
+        version = self.version_as_of(rec, ts)
+        return None if version is None else self.at(rec, version)
+
+    def append(self, rec: tuple, items: List, baseline: bool = False):
+        """Add ``items`` as the newest revision of ``rec``.
+
+        A ``baseline`` revision is only written for a record with no history yet and
+        is stamped PREHISTORY_TS: it is what the record held before tracking began.
+        """
+        with self._lock, open(self.path, "ab") as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)   # serialise appends across server processes
+            try:
+                self._refresh()
+                revs = self._index.get(rec, [])
+                if baseline:
+                    if revs:
+                        return
+                    ts = PREHISTORY_TS
+                else:
+                    # stamped under the lock and never behind the previous revision,
+                    # so each record's revisions stay sorted for as_of()
+                    ts = max(time.time(), revs[-1][0]) if revs else time.time()
+                prev = self._materialize(revs, len(revs) - 1) if revs else None
+                if prev == items:
+                    return
+                entry = {"rec": list(rec), "ts": ts}
+                if len(revs) % HISTORY_KEYFRAME_EVERY == 0:
+                    entry["kf"] = items
+                else:
+                    entry["d"] = make_delta(prev, items)
+                line = (json.dumps(entry, ensure_ascii=False) + "\n").encode("utf-8")
+                f.seek(0, os.SEEK_END)
+                offset = f.tell()
+                f.write(line)
+                f.flush()
+                if offset == self._read_upto:
+                    revs.append((ts, offset, "kf" in entry))
+                    self._index[rec] = revs
+                    self._read_upto = offset + len(line)
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def track(self, kind: str, old: Dict, new: Dict):
+        """Record a revision for every ``outer -> inner -> list`` entry that differs."""
+        for outer in list(old) + [o for o in new if o not in old]:
+            before_group, after_group = old.get(outer, {}), new.get(outer, {})
+            for inner in list(before_group) + [i for i in after_group if i not in before_group]:
+                before, after = before_group.get(inner, []), after_group.get(inner, [])
+                if before == after:
+                    continue
+                rec = (kind, outer, inner)
+                if before:
+                    # first tracked change: keep what the record looked like until now
+                    self.append(rec, before, baseline=True)
+                self.append(rec, after)
+
+# ===========================
+# --------- TENANTS ---------
+# ===========================
+# Each tenant (faculty, campus, ...) is an isolated data directory with its own
+# files, write lock and bank snapshot. Opened tenants are kept in an LRU so idle
+# ones release their cached data; lookups are O(1) whatever the tenant count.
+TENANT_NAME_RE = re.compile(r"[A-Za-z0-9_-]{1,64}")
+
+class Tenant:
+    def __init__(self, name: str, data_dir: Path, lock: threading.RLock):
+        self.name = name
+        self.data_dir = data_dir
+        self.lock = lock
+        self.files = {key: data_dir / fname for key, fname in FILE_NAMES.items()}
+        self.lock_path = data_dir / WRITE_LOCK_NAME
+        self._writing = False
+        self.ensure_files()
+        self.bank = BankSnapshot(data_dir / SNAPSHOT_NAME, self.files["questions"], self.lock_path)
+        self.history = RevisionLog(data_dir / HISTORY_NAME)
+        with self.lock:
+            self.bank.ensure()
+
+    def ensure_files(self):
+        self.data_dir.mkdir(parents=True, exist_ok=True)
+        # Only the default tenant may fall back to the built-in admin: its password
+        # is public. Other tenants get theirs from TenantRegistry.create().
+        if self.name != DEFAULT_TENANT and not self.files["users"].exists():
+            raise KeyError(f"Tenant {self.name} has no users file; recreate it from the System tab")
+        for key, path in self.files.items():
+            if not path.exists():
+                save_json(path, DEFAULTS[key])
+
+    def load(self, key: str):
+        return load_json(self.files[key], DEFAULTS[key])
+
+    @contextmanager
+    def writing(self):
+        """Hold the tenant's write lock in this process and across processes; re-entrant."""
+        with self.lock:
+            outer = not self._writing
+            self._writing = True
+            try:
+                with file_lock(self.lock_path) if outer else nullcontext():
+                    yield
+            finally:
+                if outer:
+                    self._writing = False
+
+    def save(self, key: str, data):
+        # JSON and snapshot are written under one lock so they can't come from
+        # different writers.
+        with self.writing():
+            path = self.files[key]
+            if key in HISTORY_KINDS:
+                old = self.load(key)
+            save_json(path, data)
+            if key == "questions":
+                build_bank_snapshot(data, self.bank.path)
+            if key in HISTORY_KINDS:
+                self.history.track(key, old, data)
+
+    def close(self):
+        self.bank.close()
+        self.history.close()
+
+class TenantRegistry:
+    def __init__(self, root: Path, capacity: int):
+        self.root = root
+        self.capacity = max(1, capacity)
+        self._lock = threading.Lock()
+        self._open = OrderedDict()   # name -> Tenant, least recently used first
+        self._locks = {}             # name -> RLock; kept across evictions so writers stay serialised
+
+    def data_dir(self, name: str) -> Path:
+        if name == DEFAULT_TENANT:
+            return DATA_DIR
+        if not TENANT_NAME_RE.fullmatch(name):
+            raise ValueError("Tenant names may only contain letters, digits, '-' and '_'.")
+        return self.root / name
+
+    def has_tenants(self) -> bool:
+        # O(1): stops at the first entry instead of listing every tenant.
+        try:
+            with os.scandir(self.root) as it:
+                return next(it, None) is not None
+        except FileNotFoundError:
+            return False
+
+    def names(self) -> List[str]:
+        found = sorted(p.name for p in self.root.iterdir() if p.is_dir() and TENANT_NAME_RE.fullmatch(p.name)) if self.root.exists() else []
+        return [DEFAULT_TENANT] + [n for n in found if n != DEFAULT_TENANT]
+
+    def get(self, name: str) -> Tenant:
+        with self._lock:
+            tenant = self._open.get(name)
+            if tenant is not None:
+                self._open.move_to_end(name)
+                return tenant
+        data_dir = self.data_dir(name)
+        if name != DEFAULT_TENANT and not data_dir.is_dir():
+            raise KeyError(f"Unknown tenant: {name}")
+        with self._lock:
+            lock = self._locks.setdefault(name, threading.RLock())
+        # Opening touches disk, so do it outside the registry lock; a racing opener
+        # builds an equivalent Tenant and the first one registered wins.
+        opened = Tenant(name, data_dir, lock)
+        with self._lock:
+            tenant = self._open.setdefault(name, opened)
+            self._open.move_to_end(name)
+            while len(self._open) > self.capacity:
+                self._open.popitem(last=False)[1].close()
+            return tenant
+
+    def create(self, name: str, admin_password_hash: str) -> Tenant:
+        data_dir = self.data_dir(name)
+        try:
+            if name == DEFAULT_TENANT:
+                raise FileExistsError(name)
+            data_dir.mkdir(parents=True)   # atomic: of two concurrent creates, one fails here
+        except FileExistsError:
+            raise ValueError(f"Tenant **{name}** already exists.") from None
+        # Never seed the built-in default password: it is public in the source.
+        admin = {**DEFAULTS["users"]["admin"], "password": admin_password_hash}
+        save_json(data_dir / FILE_NAMES["users"], {"admin": admin})
+        return self.get(name)
+
+@st.cache_resource
+def tenant_registry() -> TenantRegistry:
+    return TenantRegistry(TENANTS_DIR, TENANT_CACHE_SIZE)
+
+def current_tenant() -> Tenant:
+    auth = st.session_state.get("auth", {})
+    name = auth.get("tenant") if auth.get("logged_in") else st.session_state.get("login_tenant", "").strip()
+    return tenant_registry().get(name or DEFAULT_TENANT)
 
 # Accessors
-def db_users(): return load_json(FILES["users"], DEFAULTS["users"])
-def save_users(d): save_json(FILES["users"], d)
+def db_users(): return current_tenant().load("users")
+def save_users(d): current_tenant().save("users", d)
+
+def db_lecturers(): return current_tenant().load("lecturers")
+def save_lecturers(d): current_tenant().save("lecturers", d)
+
+def db_exam_personnel(): return current_tenant().load("exam_personnel")
+def save_exam_personnel(d): current_tenant().save("exam_personnel", d)
 
-def db_lecturers(): return load_json(FILES["lecturers"], DEFAULTS["lecturers"])
-def save_lecturers(d): save_json(FILES["lecturers"], d)
+def db_subjects(): return current_tenant().load("subjects")
+def save_subjects(d): current_tenant().save("subjects", d)
 
-def db_exam_personnel(): return load_json(FILES["exam_personnel"], DEFAULTS["exam_personnel"])
-def save_exam_personnel(d): save_json(FILES["exam_personnel"], d)
+def db_questions(): return current_tenant().load("questions")
+def save_questions(d): current_tenant().save("questions", d)
 
-def db_subjects(): return load_json(FILES["subjects"], DEFAULTS["subjects"])
-def save_subjects(d): save_json(FILES["subjects"], d)
+def db_exam_papers(): return current_tenant().load("exam_papers")
+def save_exam_papers(d): current_tenant().save("exam_papers", d)
 
-def db_questions(): return load_json(FILES["questions"], DEFAULTS["questions"])
-def save_questions(d): save_json(FILES["questions"], d)
+def bank_snapshot() -> BankSnapshot: return current_tenant().bank
+
+def add_question(subj: str, topic: str, q: Dict):
+    tenant = current_tenant()
+    with tenant.writing():
+        questions = tenant.load("questions")
+        questions.setdefault(subj, {}).setdefault(topic, []).append(q)
+        tenant.save("questions", questions)
+
+def change_question(subj: str, topic: str, idx: int, expected: Dict, new: Dict | None) -> bool:
+    # Views show the snapshot; only write if the JSON still holds what was shown.
+    tenant = current_tenant()
+    with tenant.writing():
+        questions = tenant.load("questions")
+        q_list = questions.get(subj, {}).get(topic, [])
+        if idx >= len(q_list) or q_list[idx] != expected:
+            return False
+        if new is None:
+            q_list.pop(idx)
+        else:
+            q_list[idx] = new
+        tenant.save("questions", questions)
+    return True
 
-def db_exam_papers(): return load_json(FILES["exam_papers"], DEFAULTS["exam_papers"])
-def save_exam_papers(d): save_json(FILES["exam_papers"], d)
+def restore_record(kind: str, outer: str, inner: str, items: List, expected: List) -> bool:
+    # Restoring is itself a save, so it shows up as the newest revision. Only
+    # overwrite what the user reviewed (``expected``).
+    tenant = current_tenant()
+    with tenant.writing():
+        data = tenant.load(kind)
+        if data.get(outer, {}).get(inner, []) != expected:
+            return False
+        data.setdefault(outer, {})[inner] = items
+        tenant.save(kind, data)
+    return True
+
+# ===========================
+# ------- CREDENTIALS -------
+# ===========================
+# Passwords are stored as "scrypt$n$r$p$salt$hash" (hex). Records that still hold
+# plaintext are accepted once and re-hashed on the next successful login.
+# hashlib.scrypt releases the GIL, so hashing runs on a small thread pool instead
+# of the script thread; when the pool and its queue are full, logins are refused
+# straight away rather than piling up behind a login storm.
+SCRYPT_N = int(os.environ.get("EMS_SCRYPT_N", str(2 ** 14)))
+SCRYPT_R = 8
+SCRYPT_P = 1
+HASH_WORKERS = int(os.environ.get("EMS_HASH_WORKERS", str(os.cpu_count() or 2)))
+HASH_QUEUE = int(os.environ.get("EMS_HASH_QUEUE", str(HASH_WORKERS * 8)))
+HASH_TIMEOUT = float(os.environ.get("EMS_HASH_TIMEOUT", "10"))
+
+class CredentialBusy(RuntimeError):
+    pass
+
+def _scrypt(password: str, salt: bytes, n: int, r: int, p: int) -> bytes:
+    return hashlib.scrypt(password.encode("utf-8"), salt=salt, n=n, r=r, p=p, maxmem=256 * r * n, dklen=32)
+
+def hash_password(password: str) -> str:
+    salt = secrets.token_bytes(16)
+    dk = _scrypt(password, salt, SCRYPT_N, SCRYPT_R, SCRYPT_P)
+    return f"scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${salt.hex()}${dk.hex()}"
+
+def verify_password(stored: str, password: str):
+    """Return (matches, needs_rehash) for a stored password record."""
+    parts = stored.split("$")
+    if len(parts) == 6 and parts[0] == "scrypt":
+        try:
+            n, r, p = int(parts[1]), int(parts[2]), int(parts[3])
+            salt, expected = bytes.fromhex(parts[4]), bytes.fromhex(parts[5])
+            dk = _scrypt(password, salt, n, r, p)
+        except ValueError:
+            pass  # not a record we wrote: fall back to treating it as plaintext
+        else:
+            return hmac.compare_digest(dk, expected), (n, r, p) != (SCRYPT_N, SCRYPT_R, SCRYPT_P)
+    # legacy plaintext record
+    return hmac.compare_digest(stored.encode("utf-8"), password.encode("utf-8")), True
+
+class CredentialPool:
+    def __init__(self, workers: int, queue_size: int, timeout: float):
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="ems-hash")
+        self._slots = threading.BoundedSemaphore(max(1, workers) + max(0, queue_size))
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise CredentialBusy("Login service is busy, please try again in a moment.")
+        try:
+            fut = self._executor.submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        fut.add_done_callback(lambda _: self._slots.release())
+        try:
+            return fut.result(timeout=self.timeout)
+        except FuturesTimeout:
+            fut.cancel()
+            raise CredentialBusy("Login timed out, please try again.")
+
+    def verify(self, stored: str, password: str):
+        return self._run(verify_password, stored, password)
+
+    def hash(self, password: str) -> str:
+        return self._run(hash_password, password)
+
+@st.cache_resource
+def credential_pool() -> CredentialPool:
+    return CredentialPool(HASH_WORKERS, HASH_QUEUE, HASH_TIMEOUT)
+
+def store_password(username: str, hashed: str):
+    # The account lives in its role DB and is mirrored in users; keep both in step.
+    tenant = current_tenant()
+    with tenant.writing():
+        for key in ("users", "lecturers", "exam_personnel"):
+            data = tenant.load(key)
+            if username in data:
+                data[username]["password"] = hashed
+                tenant.save(key, data)
 
 # ===========================
 # ------- UTILITIES ---------
@@ -125,6 +673,66 @@ def card_header(title: str, emoji: str = "📦", badge: str | None = None):
         if badge:
             st.markdown(f'<span class="badge">{badge}</span>', unsafe_allow_html=True)
 
+QUESTION_CHANGED = "This question was changed by someone else in the meantime. Reload and try again."
+
+def history_panel(kind: str, label: str, key: str):
+    log = current_tenant().history
+    recs = log.records(kind)
+    if not recs:
+        st.info("No revisions recorded yet.")
+        return
+    outer, inner = st.selectbox(label, options=recs, format_func=lambda r: f"{r[0]} / {r[1]}", key=f"{key}_rec")
+    rec = (kind, outer, inner)
+    revs = log.revisions(rec)
+    fmt = lambda ts: "pre-history (before tracking began)" if ts == PREHISTORY_TS else datetime.fromtimestamp(ts).strftime("%Y-%m-%d %H:%M:%S")
+    st.caption(f"{len(revs)} revision(s) • first {fmt(revs[0][1])} • last {fmt(revs[-1][1])}")
+    mode = st.radio("Show", ["Latest revision", "As of a date / time"], horizontal=True, key=f"{key}_mode")
+    if mode == "Latest revision":
+        version = revs[-1][0]
+    else:
+        now = datetime.now()
+        c1, c2 = st.columns(2)
+        with c1:
+            day = st.date_input("As of date", value=now.date(), key=f"{key}_day")
+        with c2:
+            tod = st.time_input("As of time", value=now.time().replace(microsecond=0), step=60, key=f"{key}_time")
+        version = log.version_as_of(rec, datetime.combine(day, tod).timestamp())
+        if version is None:
+            st.info("Nothing recorded at or before that time.")
+            return
+    items = log.at(rec, version)
+    st.write(f"**Revision {version + 1} of {len(revs)}** — {fmt(revs[version][1])}")
+    st.json(items)
+
+    # The Restore click arrives in a later script run; what the user reviewed is
+    # the diff rendered in the previous run, so that is what restore checks against.
+    reviewed_key = f"{key}_reviewed"
+    reviewed = st.session_state.get(reviewed_key)
+    current = current_tenant().load(kind).get(outer, {}).get(inner, [])
+    if items == current:
+        st.session_state[reviewed_key] = None
+        st.success("This is the current version.")
+        return
+    st.session_state[reviewed_key] = {"rec": list(rec), "version": version, "current": current}
+    st.write("**Restoring will overwrite the current version** (`-` current, `+` this revision):")
+    diff = difflib.unified_diff(
+        [_item_key(i) for i in current], [_item_key(i) for i in items],
+        fromfile="current", tofile=f"revision {version + 1}", lineterm="",
+    )
+    st.code("\n".join(diff), language="diff")
+    # a fresh checkbox key after every restore attempt, so confirmation never carries over
+    attempt = st.session_state.get(f"{key}_attempt", 0)
+    confirm = st.checkbox("I want to overwrite the current version", key=f"{key}_confirm_{attempt}")
+    if st.button("Restore this version", key=f"{key}_restore", disabled=not confirm):
+        st.session_state[f"{key}_attempt"] = attempt + 1
+        if (reviewed and reviewed["rec"] == list(rec) and reviewed["version"] == version
+                and restore_record(kind, outer, inner, items, reviewed["current"])):
+            st.session_state[reviewed_key] = None
+            st.success("Restored.")
+            st.rerun()
+        else:
+            st.error("The record changed since you reviewed the diff. Review the updated diff and confirm again.")
+
 def require_auth():
     if "auth" not in st.session_state or not st.session_state["auth"].get("logged_in", False):
         st.warning("You are not logged in.")
@@ -138,6 +746,11 @@ def reset_attempts(username: str):
         save_users(users)
 
 def try_login(username: str, password: str) -> bool:
+    try:
+        tenant = current_tenant()
+    except (KeyError, ValueError):
+        st.error("User not found.")  # same answer as a bad username: don't confirm tenants
+        return False
     users = db_users()
     all_users = {**users, **db_lecturers(), **db_exam_personnel()}  # roles in leaf DBs too
     if username not in all_users:
@@ -148,32 +761,52 @@ def try_login(username: str, password: str) -> bool:
     # Attempt/blocked tracking is stored in main users DB for all accounts.
     # Ensure a mirror exists:
     if username not in users:
-        users[username] = {"password": record["password"], "role": record["role"], "attempts": 0, "blocked": False, "name": record.get("name", username)}
-        save_users(users)
-    users = db_users()
-    mirror = users[username]
+        with tenant.writing():
+            users = db_users()
+            users.setdefault(username, {"password": record["password"], "role": record["role"], "attempts": 0, "blocked": False, "name": record.get("name", username)})
+            save_users(users)
+    mirror = db_users()[username]
 
     if mirror.get("blocked", False):
         st.error("This account is blocked due to too many failed attempts. Contact admin.")
         return False
 
-    if password == record["password"]:
-        mirror["attempts"] = 0
-        mirror["blocked"] = False
+    try:
+        ok, needs_rehash = credential_pool().verify(record["password"], password)
+    except CredentialBusy as e:
+        st.error(str(e))
+        return False
+
+    # The hash is slow, so other logins may have saved in the meantime: reload
+    # under the write lock and only touch this account's counters.
+    with tenant.writing():
+        users = db_users()
+        mirror = users.setdefault(username, mirror)
+        if ok:
+            mirror["attempts"] = 0
+            mirror["blocked"] = False
+        else:
+            mirror["attempts"] = mirror.get("attempts", 0) + 1
+            if mirror["attempts"] >= 3:
+                mirror["blocked"] = True
         save_users(users)
-        st.session_state["auth"] = {"logged_in": True, "username": username, "role": record["role"], "name": record.get("name", username)}
+
+    if ok:
+        if needs_rehash:
+            try:
+                store_password(username, credential_pool().hash(password))
+            except CredentialBusy:
+                pass  # stays on the old record; upgraded on a later login
+        st.session_state["auth"] = {"logged_in": True, "username": username, "role": record["role"], "name": record.get("name", username), "tenant": tenant.name}
         st.success("✅ Logged in successfully!")
         return True
 
     # wrong password
-    mirror["attempts"] = mirror.get("attempts", 0) + 1
-    if mirror["attempts"] >= 3:
-        mirror["blocked"] = True
+    if mirror["blocked"]:
         st.error("Too many failed attempts. You have been blocked.")
     else:
         remaining = 3 - mirror["attempts"]
         st.error(f"Login failed. {remaining} attempt(s) left.")
-    save_users(users)
     return False
 
 def logout():
@@ -222,18 +855,11 @@ def admin_dashboard():
                 new_pass = st.text_input("Set New Password", type="password", key=f"np_{user_sel}")
                 if st.button("Update Password", key=f"pw_{user_sel}") and new_pass:
                     # Update in both the canonical location (users or role-db) and mirror
-                    if user_sel in users:
-                        users[user_sel]["password"] = new_pass
-                        save_users(users)
-                    if user_sel in db_lecturers():
-                        data = db_lecturers()
-                        data[user_sel]["password"] = new_pass
-                        save_lecturers(data)
-                    if user_sel in db_exam_personnel():
-                        data = db_exam_personnel()
-                        data[user_sel]["password"] = new_pass
-                        save_exam_personnel(data)
-                    st.success("Password updated.")
+                    try:
+                        store_password(user_sel, credential_pool().hash(new_pass))
+                        st.success("Password updated.")
+                    except CredentialBusy as e:
+                        st.error(str(e))
         st.markdown('</div>', unsafe_allow_html=True)
 
     # ----- Lecturers -----
@@ -255,13 +881,18 @@ def admin_dashboard():
             elif lu in lecturers:
                 st.error("Username already exists.")
             else:
-                lecturers[lu] = {"password": lp, "role": "lecturer", "profile": {"name": lname, "address": laddr, "contact_number": lphone}}
-                save_lecturers(lecturers)
-                # mirror in users DB
-                users = db_users()
-                users[lu] = {"password": lp, "role": "lecturer", "attempts": 0, "blocked": False, "name": lname or lu}
-                save_users(users)
-                st.success(f"Lecturer **{lu}** added.")
+                try:
+                    lp_hash = credential_pool().hash(lp)
+                except CredentialBusy as e:
+                    st.error(str(e))
+                else:
+                    lecturers[lu] = {"password": lp_hash, "role": "lecturer", "profile": {"name": lname, "address": laddr, "contact_number": lphone}}
+                    save_lecturers(lecturers)
+                    # mirror in users DB
+                    users = db_users()
+                    users[lu] = {"password": lp_hash, "role": "lecturer", "attempts": 0, "blocked": False, "name": lname or lu}
+                    save_users(users)
+                    st.success(f"Lecturer **{lu}** added.")
 
         st.write("### Existing Lecturers")
         if lecturers:
@@ -304,12 +935,17 @@ def admin_dashboard():
             elif eu in ex:
                 st.error("Username already exists.")
             else:
-                ex[eu] = {"password": ep, "role": "exam_personnel", "profile": {"name": ename, "contact_number": ephone}}
-                save_exam_personnel(ex)
-                users = db_users()
-                users[eu] = {"password": ep, "role": "exam_personnel", "attempts": 0, "blocked": False, "name": ename or eu}
-                save_users(users)
-                st.success(f"Exam personnel **{eu}** added.")
+                try:
+                    ep_hash = credential_pool().hash(ep)
+                except CredentialBusy as e:
+                    st.error(str(e))
+                else:
+                    ex[eu] = {"password": ep_hash, "role": "exam_personnel", "profile": {"name": ename, "contact_number": ephone}}
+                    save_exam_personnel(ex)
+                    users = db_users()
+                    users[eu] = {"password": ep_hash, "role": "exam_personnel", "attempts": 0, "blocked": False, "name": ename or eu}
+                    save_users(users)
+                    st.success(f"Exam personnel **{eu}** added.")
         st.write("### Existing Exam Personnel")
         if ex:
             colA, colB = st.columns([2, 1])
@@ -366,7 +1002,7 @@ def admin_dashboard():
         st.markdown('<div class="card">', unsafe_allow_html=True)
         card_header("Questions", "❓", "bank")
         subjects = db_subjects()
-        questions = db_questions()
+        bank = bank_snapshot()
 
         col1, col2 = st.columns(2)
         with col1:
@@ -381,40 +1017,45 @@ def admin_dashboard():
                 if not subj or not topic or not q_text or not ans_text:
                     st.error("All fields required.")
                 else:
-                    questions.setdefault(subj, {}).setdefault(topic, []).append({"question": q_text, "answer": ans_text})
-                    save_questions(questions)
+                    add_question(subj, topic, {"question": q_text, "answer": ans_text})
                     st.success("Question added.")
 
         with col2:
             st.write("#### Update / View Questions")
-            subj2 = st.selectbox("Subject (view)", options=[""] + list(questions.keys()))
+            # Browsing reads the shared snapshot; the JSON bank is only loaded to write.
+            subj2 = st.selectbox("Subject (view)", options=[""] + bank.subjects())
             topic2 = None
             if subj2:
-                topic2 = st.selectbox("Topic", options=[""] + list(questions[subj2].keys()))
+                topic2 = st.selectbox("Topic", options=[""] + bank.topics(subj2))
             if subj2 and topic2:
-                q_list = questions[subj2][topic2]
-                if not q_list:
+                n_q = bank.count(subj2, topic2)
+                if not n_q:
                     st.info("No questions in this topic.")
                 else:
-                    idx = st.number_input("Question Index", min_value=0, max_value=len(q_list)-1, step=1)
+                    idx = st.number_input("Question Index", min_value=0, max_value=n_q-1, step=1)
+                    cur_q = bank.question(subj2, topic2, idx)
                     st.write("**Current Question:**")
-                    st.write(q_list[idx]["question"])
+                    st.write(cur_q["question"])
                     st.write("**Current Answer:**")
-                    st.write(q_list[idx]["answer"])
-                    new_q = st.text_area("New Question", value=q_list[idx]["question"])
-                    new_a = st.text_area("New Answer", value=q_list[idx]["answer"])
+                    st.write(cur_q["answer"])
+                    new_q = st.text_area("New Question", value=cur_q["question"])
+                    new_a = st.text_area("New Answer", value=cur_q["answer"])
                     colU, colD = st.columns(2)
                     with colU:
                         if st.button("Update Question"):
-                            q_list[idx] = {"question": new_q, "answer": new_a}
-                            save_questions(questions)
-                            st.success("Question updated.")
+                            if change_question(subj2, topic2, idx, cur_q, {"question": new_q, "answer": new_a}):
+                                st.success("Question updated.")
+                            else:
+                                st.error(QUESTION_CHANGED)
                     with colD:
                         if st.button("Delete Question", type="secondary"):
-                            q_list.pop(idx)
-                            save_questions(questions)
-                            st.success("Question deleted.")
-                            st.rerun()
+                            if change_question(subj2, topic2, idx, cur_q, None):
+                                st.success("Question deleted.")
+                                st.rerun()
+                            else:
+                                st.error(QUESTION_CHANGED)
+        with st.expander("🕘 History — view / restore a topic as of a date"):
+            history_panel("questions", "Subject / Topic", "q_hist")
         st.markdown('</div>', unsafe_allow_html=True)
 
     # ----- Exam Papers -----
@@ -463,6 +1104,8 @@ def admin_dashboard():
         st.write("#### View Exam Paper")
         set_view = st.selectbox("Exam Set (view)", options=list(papers.keys()), key="viewset")
         st.json(papers[set_view])
+        with st.expander("🕘 History — view / restore a section as of a date"):
+            history_panel("exam_papers", "Exam Set / Section", "p_hist")
         st.markdown('</div>', unsafe_allow_html=True)
 
     # ----- System -----
@@ -470,17 +1113,38 @@ def admin_dashboard():
         st.markdown('<div class="card">', unsafe_allow_html=True)
         card_header("System Tools", "🔧", "maintenance")
         if st.button("🔄 Reset Demo Data (Keeps Admin)"):
-            # reset all except admin base users
-            save_json(FILES["lecturers"], DEFAULTS["lecturers"])
-            save_json(FILES["exam_personnel"], DEFAULTS["exam_personnel"])
-            save_json(FILES["subjects"], DEFAULTS["subjects"])
-            save_json(FILES["questions"], DEFAULTS["questions"])
-            save_json(FILES["exam_papers"], DEFAULTS["exam_papers"])
+            # reset all except admin base users (current tenant only)
+            tenant = current_tenant()
+            tenant.save("lecturers", DEFAULTS["lecturers"])
+            tenant.save("exam_personnel", DEFAULTS["exam_personnel"])
+            tenant.save("subjects", DEFAULTS["subjects"])
+            tenant.save("questions", DEFAULTS["questions"])
+            tenant.save("exam_papers", DEFAULTS["exam_papers"])
             # keep admin, clean non-admin entries
-            users = DEFAULTS["users"]
-            save_json(FILES["users"], users)
+            with tenant.writing():
+                users = {u: r for u, r in tenant.load("users").items() if r.get("role") == "admin"}
+                if not users and tenant.name == DEFAULT_TENANT:
+                    users = DEFAULTS["users"]
+                tenant.save("users", users)
             st.success("Reset completed.")
             st.rerun()
+        if current_tenant().name == DEFAULT_TENANT:
+            st.write("#### Tenants")
+            registry = tenant_registry()
+            st.write(", ".join(registry.names()))
+            with st.form("add_tenant"):
+                tname = st.text_input("New Tenant Name", placeholder="faculty-of-science")
+                tpass = st.text_input("Initial Admin Password", type="password")
+                add_t = st.form_submit_button("Create Tenant")
+            if add_t:
+                if tpass.strip() == "":
+                    st.error("An initial admin password is required.")
+                else:
+                    try:
+                        registry.create(tname.strip(), credential_pool().hash(tpass))
+                        st.success(f"Tenant **{tname.strip()}** created. Log in to it as **admin** with the password you set.")
+                    except (ValueError, CredentialBusy) as e:
+                        st.error(str(e))
         st.markdown('</div>', unsafe_allow_html=True)
 
 # ===========================
@@ -497,7 +1161,7 @@ def lecturer_dashboard():
     with tabs[0]:
         st.markdown('<div class="card soft">', unsafe_allow_html=True)
         subjects = db_subjects()
-        questions = db_questions()
+        bank = bank_snapshot()
 
         st.write("### Add Question")
         with st.form("lec_add_q"):
@@ -510,36 +1174,38 @@ def lecturer_dashboard():
             if not subj or not topic or not q or not a:
                 st.error("All fields required.")
             else:
-                questions.setdefault(subj, {}).setdefault(topic, []).append({"question": q, "answer": a})
-                save_questions(questions)
+                add_question(subj, topic, {"question": q, "answer": a})
                 st.success("Question added.")
 
         st.write("### View / Update")
-        subj2 = st.selectbox("Subject (view)", options=[""] + list(questions.keys()), key="lec_s2")
+        subj2 = st.selectbox("Subject (view)", options=[""] + bank.subjects(), key="lec_s2")
         if subj2:
-            topic2 = st.selectbox("Topic", options=[""] + list(questions[subj2].keys()), key="lec_t2")
+            topic2 = st.selectbox("Topic", options=[""] + bank.topics(subj2), key="lec_t2")
             if topic2:
-                q_list = questions[subj2][topic2]
-                if q_list:
-                    idx = st.number_input("Index", min_value=0, max_value=len(q_list)-1, step=1, key="lec_idx")
+                n_q = bank.count(subj2, topic2)
+                if n_q:
+                    idx = st.number_input("Index", min_value=0, max_value=n_q-1, step=1, key="lec_idx")
+                    cur_q = bank.question(subj2, topic2, idx)
                     st.write("**Current Question:**")
-                    st.write(q_list[idx]["question"])
+                    st.write(cur_q["question"])
                     st.write("**Current Answer:**")
-                    st.write(q_list[idx]["answer"])
-                    new_q = st.text_area("New Question", value=q_list[idx]["question"], key="lec_newq")
-                    new_a = st.text_area("New Answer", value=q_list[idx]["answer"], key="lec_newa")
+                    st.write(cur_q["answer"])
+                    new_q = st.text_area("New Question", value=cur_q["question"], key="lec_newq")
+                    new_a = st.text_area("New Answer", value=cur_q["answer"], key="lec_newa")
                     c1, c2 = st.columns(2)
                     with c1:
                         if st.button("Update", key="lec_upd"):
-                            q_list[idx] = {"question": new_q, "answer": new_a}
-                            save_questions(questions)
-                            st.success("Updated.")
+                            if change_question(subj2, topic2, idx, cur_q, {"question": new_q, "answer": new_a}):
+                                st.success("Updated.")
+                            else:
+                                st.error(QUESTION_CHANGED)
                     with c2:
                         if st.button("Delete", key="lec_del", type="secondary"):
-                            q_list.pop(idx)
-                            save_questions(questions)
-                            st.success("Deleted.")
-                            st.rerun()
+                            if change_question(subj2, topic2, idx, cur_q, None):
+                                st.success("Deleted.")
+                                st.rerun()
+                            else:
+                                st.error(QUESTION_CHANGED)
                 else:
                     st.info("No questions here yet.")
             else:
@@ -554,15 +1220,11 @@ def lecturer_dashboard():
             new_pw = st.text_input("New Password", type="password")
             if st.button("Update Password"):
                 # Update both lecturer DB & users mirror
-                lec = db_lecturers()
-                if auth["username"] in lec:
-                    lec[auth["username"]]["password"] = new_pw
-                    save_lecturers(lec)
-                users = db_users()
-                if auth["username"] in users:
-                    users[auth["username"]]["password"] = new_pw
-                    save_users(users)
-                st.success("Password updated.")
+                try:
+                    store_password(auth["username"], credential_pool().hash(new_pw))
+                    st.success("Password updated.")
+                except CredentialBusy as e:
+                    st.error(str(e))
         with col2:
             new_un = st.text_input("New Username")
             if st.button("Update Username"):
@@ -635,6 +1297,8 @@ def exam_personnel_dashboard():
                     st.rerun()
         else:
             st.info("No questions in this section yet.")
+        with st.expander("🕘 History — view / restore a section as of a date"):
+            history_panel("exam_papers", "Exam Set / Section", "ep_p_hist")
         st.markdown('</div>', unsafe_allow_html=True)
 
     with tabs[1]:
@@ -644,15 +1308,11 @@ def exam_personnel_dashboard():
         with col1:
             new_pw = st.text_input("New Password", type="password", key="ep_pw")
             if st.button("Update Password", key="ep_pw_btn"):
-                ep = db_exam_personnel()
-                if auth["username"] in ep:
-                    ep[auth["username"]]["password"] = new_pw
-                    save_exam_personnel(ep)
-                users = db_users()
-                if auth["username"] in users:
-                    users[auth["username"]]["password"] = new_pw
-                    save_users(users)
-                st.success("Password updated.")
+                try:
+                    store_password(auth["username"], credential_pool().hash(new_pw))
+                    st.success("Password updated.")
+                except CredentialBusy as e:
+                    st.error(str(e))
         with col2:
             new_un = st.text_input("New Username", key="ep_un")
             if st.button("Update Username", key="ep_un_btn"):
@@ -677,6 +1337,9 @@ def exam_personnel_dashboard():
 def login_ui():
     st.markdown('<div class="card">', unsafe_allow_html=True)
     st.write("## 🔐 Login")
+    # Tenant names are typed, not listed, so anonymous visitors can't enumerate them.
+    if tenant_registry().has_tenants():
+        st.text_input("Tenant", placeholder="leave empty for the default", key="login_tenant")
     username = st.text_input("Username")
     password = st.text_input("Password", type="password")
     col1, col2 = st.columns([1, 3])
@@ -698,7 +1361,7 @@ def navbar():
             st.write("### 📚 Exam Management System")
         with cols[1]:
             if "auth" in st.session_state and st.session_state["auth"].get("logged_in"):
-                st.write(f"**{st.session_state['auth']['username']}** — `{st.session_state['auth']['role']}`")
+                st.write(f"**{st.session_state['auth']['username']}** — `{st.session_state['auth']['role']}` @ `{st.session_state['auth'].get('tenant', DEFAULT_TENANT)}`")
         with cols[2]:
             if "auth" in st.session_state and st.session_state["auth"].get("logged_in"):
                 st.button("🚪 Logout", on_click=logout)
@@ -0,0 +1,61 @@
+"""Login throughput benchmark: N concurrent callers verifying passwords through
+CredentialPool at the production scrypt cost.
+
+    python bench_login.py --callers 8 --logins 200 > bench_output.txt
+"""
+import argparse
+import os
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+os.environ["EMS_SCRYPT_N"] = str(2 ** 14)   # production cost, whatever the shell says
+
+import app  # noqa: E402  (after the env override)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--callers", type=int, default=8, help="concurrent login attempts")
+    parser.add_argument("--logins", type=int, default=200, help="total login attempts")
+    parser.add_argument("--workers", type=int, default=app.HASH_WORKERS, help="hash pool threads")
+    parser.add_argument("--queue", type=int, default=app.HASH_QUEUE, help="extra queued hash jobs")
+    args = parser.parse_args()
+
+    assert app.SCRYPT_N == 2 ** 14
+    pool = app.CredentialPool(args.workers, args.queue, app.HASH_TIMEOUT)
+    stored = app.hash_password("correct horse battery staple")
+    latencies, rejected, lock = [], [0], threading.Lock()
+
+    def login(i):
+        # alternate good and bad passwords; both cost one full scrypt
+        password = "correct horse battery staple" if i % 2 == 0 else "wrong"
+        t0 = time.perf_counter()
+        try:
+            ok, _ = pool.verify(stored, password)
+            assert ok == (i % 2 == 0)
+        except app.CredentialBusy:
+            with lock:
+                rejected[0] += 1
+            return
+        with lock:
+            latencies.append(time.perf_counter() - t0)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.callers) as callers:
+        list(callers.map(login, range(args.logins)))
+    elapsed = time.perf_counter() - start
+
+    lat = sorted(latencies)
+    print(f"scrypt n={app.SCRYPT_N} r={app.SCRYPT_R} p={app.SCRYPT_P}  cpus={os.cpu_count()}")
+    print(f"callers={args.callers} workers={args.workers} queue={args.queue} logins={args.logins}")
+    print(f"completed={len(lat)} rejected={rejected[0]} elapsed={elapsed:.2f}s")
+    print(f"throughput={len(lat) / elapsed:.1f} logins/s")
+    if lat:
+        p95 = lat[min(len(lat) - 1, int(len(lat) * 0.95))]
+        print(f"latency p50={statistics.median(lat) * 1000:.1f}ms p95={p95 * 1000:.1f}ms max={lat[-1] * 1000:.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
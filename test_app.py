@@ -0,0 +1,384 @@
+import json
+import random
+import threading
+from datetime import date
+from pathlib import Path
+
+import pytest
+
+import app
+
+
+# ---------- bank snapshot ----------
+def make_bank(tmp_path, questions):
+    q_path, snap_path = tmp_path / "questions.json", tmp_path / "questions.snap"
+    app.save_json(q_path, questions)
+    app.build_bank_snapshot(questions, snap_path)
+    return app.BankSnapshot(snap_path, q_path, tmp_path / ".write.lock")
+
+
+def test_snapshot_round_trip(tmp_path):
+    questions = {
+        "Math": {"Algebra": [{"question": "1+1?", "answer": "2"}, {"question": "x²=4?", "answer": "±2"}], "Geometry": []},
+        "Biology": {"Cells": [{"question": "What is a cell?", "answer": "Unit of life"}]},
+    }
+    bank = make_bank(tmp_path, questions)
+    assert bank.subjects() == ["Math", "Biology"]
+    assert bank.topics("Math") == ["Algebra", "Geometry"]
+    assert bank.count("Math", "Geometry") == 0
+    assert bank.count("Nope", "Nope") == 0
+    with pytest.raises(IndexError):
+        bank.question("Math", "Algebra", 2)
+    for subj, topics in questions.items():
+        for topic, q_list in topics.items():
+            assert [bank.question(subj, topic, i) for i in range(bank.count(subj, topic))] == q_list
+
+
+def test_snapshot_swaps_to_rebuilt_file(tmp_path):
+    questions = {"Math": {"Algebra": [{"question": "q", "answer": "a"}]}}
+    bank = make_bank(tmp_path, questions)
+    assert bank.question("Math", "Algebra", 0)["answer"] == "a"
+    questions["Math"]["Algebra"].append({"question": "q2", "answer": "b"})
+    app.build_bank_snapshot(questions, bank.path)
+    assert bank.count("Math", "Algebra") == 2
+    assert bank.question("Math", "Algebra", 1)["answer"] == "b"
+
+
+def test_snapshot_rebuilt_when_missing(tmp_path):
+    bank = make_bank(tmp_path, {"Math": {"Algebra": [{"question": "q", "answer": "a"}]}})
+    bank.path.unlink()
+    assert bank.subjects() == ["Math"]
+
+
+def test_snapshot_readers_see_consistent_state_during_swaps(tmp_path):
+    # Every rebuild holds 1..40 questions of the same shape; a reader that mixed one
+    # snapshot's index with another's mapping would fail to decode or find them.
+    bank = make_bank(tmp_path, {"S": {"T": [{"question": "q0", "answer": "a"}]}})
+    stop = threading.Event()
+    errors = []
+
+    def reader():
+        while not stop.is_set():
+            try:
+                assert bank.question("S", "T", 0)["answer"] == "a"
+            except Exception as e:  # pragma: no cover - reported below
+                errors.append(e)
+
+    threads = [threading.Thread(target=reader) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for i in range(200):
+        app.build_bank_snapshot({"S": {"T": [{"question": f"q{k}", "answer": "a"} for k in range(1 + i % 40)]}}, bank.path)
+        bank.close()
+    stop.set()
+    for t in threads:
+        t.join()
+    assert errors == []
+
+
+def test_snapshot_in_old_format_is_rebuilt(tmp_path):
+    bank = make_bank(tmp_path, {"Math": {"Algebra": [{"question": "q", "answer": "a"}]}})
+    bank.path.write_bytes(b"EMSBANK1" + bytes(8))
+    bank.ensure()
+    assert bank.question("Math", "Algebra", 0) == {"question": "q", "answer": "a"}
+
+
+# ---------- tenants ----------
+def test_registry_rejects_invalid_and_unknown_names(tmp_path):
+    registry = app.TenantRegistry(tmp_path / "tenants", 4)
+    assert not registry.has_tenants()
+    for bad in ("../escape", "a b", "", "x" * 65):
+        with pytest.raises(ValueError):
+            registry.get(bad)
+        with pytest.raises(ValueError):
+            registry.create(bad, "hash")
+    with pytest.raises(KeyError):
+        registry.get("nope")
+    (tmp_path / "tenants" / "by-hand").mkdir(parents=True)   # no users file: refused, not seeded
+    with pytest.raises(KeyError):
+        registry.get("by-hand")
+    assert not (tmp_path / "tenants" / "by-hand" / "user_db.json").exists()
+
+
+def test_create_stores_admin_hash_and_refuses_existing(tmp_path):
+    registry = app.TenantRegistry(tmp_path / "tenants", 4)
+    tenant = registry.create("sci", "scrypt$hash")
+    assert registry.has_tenants()
+    assert tenant.load("users")["admin"]["password"] == "scrypt$hash"
+    assert registry.names() == [app.DEFAULT_TENANT, "sci"]
+    for name in ("sci", app.DEFAULT_TENANT):
+        with pytest.raises(ValueError):
+            registry.create(name, "other")
+    assert registry.get("sci").load("users")["admin"]["password"] == "scrypt$hash"
+
+
+def test_concurrent_creates_of_one_name(tmp_path):
+    registry = app.TenantRegistry(tmp_path / "tenants", 4)
+    results = []
+
+    def create():
+        try:
+            registry.create("race", "h")
+            results.append("ok")
+        except ValueError:
+            results.append("exists")
+
+    threads = [threading.Thread(target=create) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert sorted(results) == ["exists"] * 7 + ["ok"]
+
+
+def test_tenants_are_isolated(tmp_path):
+    registry = app.TenantRegistry(tmp_path / "tenants", 4)
+    a, b = registry.create("a", "h"), registry.create("b", "h")
+    a.save("subjects", {"Math": ["Loops", "Functions", "OOP"]})
+    a.save("questions", {"Math": {"Loops": [{"question": "q", "answer": "a"}]}})
+    assert b.load("subjects") == {}
+    assert b.load("questions") == {}
+    assert b.bank.subjects() == []
+    assert a.bank.subjects() == ["Math"]
+    assert b.history.records("questions") == []
+
+
+def test_lru_eviction_closes_tenant_but_keeps_it_usable(tmp_path, monkeypatch):
+    registry = app.TenantRegistry(tmp_path / "tenants", 1)
+    a = registry.create("a", "h")
+    a.save("questions", {"Math": {"Loops": [{"question": "q", "answer": "a"}]}})
+    assert a.bank.count("Math", "Loops") == 1
+    closed = []
+    monkeypatch.setattr(a, "close", lambda orig=a.close: (closed.append("a"), orig()))
+    registry.create("b", "h")
+    assert closed == ["a"]
+    assert list(registry._open) == ["b"]
+    assert a.bank._state[1] is None               # mapping dropped
+    assert a.bank.count("Math", "Loops") == 1      # ... and re-mapped on demand
+    again = registry.get("a")
+    assert again is not a and again.lock is a.lock   # write lock survives eviction
+    assert again.bank.question("Math", "Loops", 0) == {"question": "q", "answer": "a"}
+
+
+# ---------- credentials ----------
+def cheap_scrypt(monkeypatch, n=2 ** 4):
+    monkeypatch.setattr(app, "SCRYPT_N", n)
+
+
+def test_verify_hashed_password(monkeypatch):
+    cheap_scrypt(monkeypatch)
+    stored = app.hash_password("s3cret")
+    assert stored.startswith(f"scrypt${2 ** 4}$")
+    assert app.verify_password(stored, "s3cret") == (True, False)
+    assert app.verify_password(stored, "wrong") == (False, False)
+    assert app.hash_password("s3cret") != stored   # salted
+
+
+def test_verify_legacy_plaintext_needs_rehash(monkeypatch):
+    cheap_scrypt(monkeypatch)
+    assert app.verify_password("admin123", "admin123") == (True, True)
+    assert app.verify_password("admin123", "nope") == (False, True)
+
+
+def test_verify_outdated_cost_needs_rehash(monkeypatch):
+    cheap_scrypt(monkeypatch, 2 ** 4)
+    stored = app.hash_password("s3cret")
+    cheap_scrypt(monkeypatch, 2 ** 5)
+    assert app.verify_password(stored, "s3cret") == (True, True)
+    assert app.verify_password(stored, "wrong") == (False, True)
+
+
+def test_verify_malformed_scrypt_record_is_treated_as_plaintext(monkeypatch):
+    cheap_scrypt(monkeypatch)
+    assert app.verify_password("scrypt$a$b$c$d$e", "x") == (False, True)
+    assert app.verify_password("scrypt$a$b$c$d$e", "scrypt$a$b$c$d$e") == (True, True)
+    assert app.verify_password("scrypt$3$8$1$00$00", "x") == (False, True)   # n not a power of two
+
+
+def test_credential_pool_rejects_when_full(monkeypatch):
+    cheap_scrypt(monkeypatch)
+    pool = app.CredentialPool(workers=1, queue_size=0, timeout=5)
+    release = threading.Event()
+    started = threading.Event()
+
+    def blocker():
+        started.set()
+        release.wait(5)
+
+    caller = threading.Thread(target=pool._run, args=(blocker,))
+    caller.start()
+    started.wait(5)
+    try:
+        with pytest.raises(app.CredentialBusy):
+            pool.verify("admin123", "admin123")
+    finally:
+        release.set()
+        caller.join()
+    assert pool.verify("admin123", "admin123") == (True, True)
+
+
+@pytest.fixture
+def login_tenant(tmp_path, monkeypatch):
+    """A throwaway tenant wired in as the current one, with a cheap hash pool."""
+    cheap_scrypt(monkeypatch)
+    app.save_json(tmp_path / "user_db.json", {})
+    tenant = app.Tenant("t", tmp_path, threading.RLock())
+    pool = app.CredentialPool(workers=4, queue_size=16, timeout=10)
+    monkeypatch.setattr(app, "current_tenant", lambda: tenant)
+    monkeypatch.setattr(app, "credential_pool", lambda: pool)
+    monkeypatch.setattr(app.st, "session_state", {})
+    return tenant
+
+
+def test_parallel_bad_logins_block_the_account(login_tenant):
+    login_tenant.save("users", {"admin": {"password": app.hash_password("right"), "role": "admin", "attempts": 0, "blocked": False}})
+    threads = [threading.Thread(target=app.try_login, args=("admin", "wrong")) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    admin = login_tenant.load("users")["admin"]
+    # logins that start after the block is saved are refused before counting
+    assert 3 <= admin["attempts"] <= 8
+    assert admin["blocked"] is True
+    assert app.try_login("admin", "right") is False   # blocked even with the right password
+
+
+def test_plaintext_password_upgraded_on_first_login(login_tenant):
+    login_tenant.save("lecturers", {"lee": {"password": "pw1", "role": "lecturer", "profile": {"name": "Lee"}}})
+    login_tenant.save("users", {"lee": {"password": "pw1", "role": "lecturer", "attempts": 0, "blocked": False, "name": "Lee"}})
+
+    assert app.try_login("lee", "pw1") is True
+    stored = login_tenant.load("lecturers")["lee"]["password"]
+    assert stored.startswith("scrypt$")
+    assert login_tenant.load("users")["lee"]["password"] == stored
+    assert app.verify_password(stored, "pw1") == (True, False)
+
+    assert app.try_login("lee", "pw1") is True
+    assert login_tenant.load("lecturers")["lee"]["password"] == stored   # not re-hashed again
+    assert app.try_login("lee", "nope") is False
+
+
+# ---------- revision history ----------
+def test_delta_round_trip():
+    prev = [{"question": f"q{i}", "answer": "a"} for i in range(6)]
+    cases = [
+        prev,
+        [],
+        prev[:2] + [{"question": "new", "answer": "b"}] + prev[3:],   # replace
+        prev[1:],                                                     # delete head
+        prev + [{"question": "tail", "answer": "c"}],                 # append
+        list(reversed(prev)),
+    ]
+    for items in cases:
+        assert app.apply_delta(prev, app.make_delta(prev, items)) == items
+    # unchanged items are referenced, not copied
+    assert app.make_delta(prev, prev) == [["c", 0, 6]]
+
+
+def test_revision_log_as_of_across_keyframes(tmp_path, monkeypatch):
+    clock = iter(range(1000, 2000))
+    monkeypatch.setattr(app.time, "time", lambda: float(next(clock)))
+    log = app.RevisionLog(tmp_path / "history.jsonl")
+    rec = ("questions", "Math", "Algebra")
+    expected = []
+    items = []
+    for i in range(3 * app.HISTORY_KEYFRAME_EVERY + 5):
+        if i % 7 == 6 and items:
+            items = items[1:]
+        else:
+            items = items + [{"question": f"q{i}", "answer": "a"}]
+        log.append(rec, items)
+        expected.append(list(items))
+
+    revs = log.revisions(rec)
+    assert len(revs) == len(expected)
+    assert [ts for _, ts in revs] == sorted(ts for _, ts in revs)
+    for (version, ts), items in zip(revs, expected):
+        assert log.at(rec, version) == items
+        assert log.as_of(rec, ts) == items
+        assert log.as_of(rec, ts + 0.5) == items
+    assert log.as_of(rec, revs[0][1] - 1) is None
+
+    # a fresh reader rebuilds the same index from disk
+    fresh = app.RevisionLog(log.path)
+    assert [fresh.at(rec, v) for v, _ in fresh.revisions(rec)] == expected
+
+
+def test_revision_log_is_compact(tmp_path):
+    rng = random.Random(0)
+    log = app.RevisionLog(tmp_path / "history.jsonl")
+    items = [{"question": f"Q{i} " + "x" * 200, "answer": "a" * 200} for i in range(30)]
+    old = {"Math": {"Algebra": list(items)}}
+    full_copies = 0
+    for k in range(100):
+        i = rng.randrange(len(items))
+        if k % 10 == 9:
+            items.pop(i)
+        else:
+            items[i] = {"question": f"edit{k} " + "y" * 200, "answer": "b" * 200}
+        new = {"Math": {"Algebra": list(items)}}
+        log.track("questions", old, new)
+        old = new
+        full_copies += len(json.dumps(items))
+        assert log.at(("questions", "Math", "Algebra"), len(log.revisions(("questions", "Math", "Algebra"))) - 1) == items
+    assert log.path.stat().st_size < full_copies * 0.25
+
+
+def test_track_records_pre_history_baseline(tmp_path):
+    log = app.RevisionLog(tmp_path / "history.jsonl")
+    log.track("exam_papers", {"Set 1": {"Section A": ["old"], "Section B": []}}, {"Set 1": {"Section A": ["new"], "Section B": []}})
+    rec = ("exam_papers", "Set 1", "Section A")
+    revs = log.revisions(rec)
+    assert revs[0] == (0, app.PREHISTORY_TS)
+    assert log.as_of(rec, 1.0) == ["old"]          # any date before the first tracked edit
+    assert log.at(rec, 1) == ["new"]
+    assert log.records("exam_papers") == [("Set 1", "Section A")]   # untouched sections aren't logged
+    # no-op saves don't add revisions, and a second baseline is never written
+    log.append(rec, ["new"])
+    log.append(rec, ["x"], baseline=True)
+    assert len(log.revisions(rec)) == 2
+
+
+def test_revision_timestamps_never_go_backwards(tmp_path, monkeypatch):
+    stamps = iter([100.0, 50.0, 75.0])
+    monkeypatch.setattr(app.time, "time", lambda: next(stamps))
+    log = app.RevisionLog(tmp_path / "history.jsonl")
+    rec = ("questions", "S", "T")
+    for items in (["a"], ["b"], ["c"]):
+        log.append(rec, items)
+    assert [ts for _, ts in log.revisions(rec)] == [100.0, 100.0, 100.0]
+    assert log.as_of(rec, 100.0) == ["c"]
+
+
+def test_restore_refuses_edit_made_after_diff_was_reviewed(tmp_path, monkeypatch):
+    from streamlit.testing.v1 import AppTest
+
+    monkeypatch.chdir(tmp_path)   # the app keeps the default tenant in the working directory
+    app.st.cache_resource.clear()
+    app.save_json(tmp_path / "questions.json", {"Math": {"Alg": [{"question": "q1", "answer": "a"}]}})
+    at = AppTest.from_file(str(Path(app.__file__)), default_timeout=30).run()
+    at.text_input[0].input("admin")
+    at.text_input[1].input("hello@")
+    at.button[0].click().run()
+    at.run()
+    tenant = app.TenantRegistry(tmp_path / "tenants", 1).get(app.DEFAULT_TENANT)
+    tenant.save("questions", {"Math": {"Alg": [{"question": "q1 v2", "answer": "a"}]}})
+
+    at.run()
+    at.radio(key="q_hist_mode").set_value("As of a date / time").run()
+    at.date_input(key="q_hist_day").set_value(date(2000, 1, 1)).run()   # -> pre-history baseline
+    at.checkbox(key="q_hist_confirm_0").check().run()
+    # someone edits the record after the diff was reviewed and confirmed
+    tenant.save("questions", {"Math": {"Alg": [{"question": "q1 v3", "answer": "a"}]}})
+    at.button(key="q_hist_restore").click().run()
+    assert tenant.load("questions")["Math"]["Alg"][0]["question"] == "q1 v3"
+    assert any("changed since you reviewed" in e.value for e in at.error)
+    at.run()
+    assert not at.checkbox(key="q_hist_confirm_1").value   # confirmation reset
+    assert at.button(key="q_hist_restore").disabled
+
+    # confirming against the updated diff restores it
+    at.checkbox(key="q_hist_confirm_1").check().run()
+    at.button(key="q_hist_restore").click().run()
+    assert tenant.load("questions")["Math"]["Alg"][0]["question"] == "q1"